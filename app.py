@@ -4,49 +4,175 @@
 # It supports step-by-step complaint collection, validation, voice input (Whisper),
 # and a modern frontend UI. Designed for clarity, maintainability, and extensibility.
 
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, request, jsonify, render_template, Response, stream_with_context, g
+from flask.json.provider import JSONProvider
 import requests
 import re
-import json
+import orjson
 import os
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 import sys
 import socket
 import atexit
+import threading
+import uuid
+from collections import deque, OrderedDict
+from itertools import islice
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
 # Requirements for audio transcription:
-# pip install openai-whisper torch
-# ffmpeg must be installed and available in PATH
-import tempfile
-import whisper
+# pip install faster-whisper
+import io
+from faster_whisper import WhisperModel
+from faster_whisper.audio import decode_audio
 
 # ---------------------- Logging Setup ----------------------
-logging.basicConfig(level=logging.DEBUG, filename='chatbot.log', filemode='a',
-                    format='%(asctime)s - %(levelname)s - %(message)s')
+# Request threads only enqueue records; a background listener thread writes them to chatbot.log.
+# Set LOG_LEVEL=DEBUG to include the verbose request/prompt logs.
+log_file_handler = logging.FileHandler('chatbot.log', mode='a')
+log_file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+log_queue_handler = QueueHandler(queue.Queue())
+log_queue_handler.setFormatter(logging.Formatter('%(message)s'))  # Full format is applied by the file handler
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), handlers=[log_queue_handler])
 logger = logging.getLogger(__name__)
 
+def start_log_listener():
+    """Start the background thread that drains queued log records into the log file."""
+    global log_listener
+    log_queue_handler.queue = queue.Queue()
+    log_listener = QueueListener(log_queue_handler.queue, log_file_handler)
+    log_listener.start()
+
+start_log_listener()
+# Forked child processes don't inherit the listener thread, so each starts its own
+os.register_at_fork(after_in_child=start_log_listener)
+
 # ---------------------- Flask App Setup ----------------------
+class ORJSONProvider(JSONProvider):
+    """Flask JSON provider backed by orjson, used by jsonify() and request.get_json()."""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 app = Flask(__name__, template_folder='templates', static_folder='static')
+app.json = ORJSONProvider(app)
 
 # ---------------------- LM Studio API Config ----------------------
 LM_STUDIO_API_URL = "http://localhost:1234/v1/completions"  # Update if needed
 LM_STUDIO_API_KEY = ""  # Add your LM Studio API key if required
-
-# ---------------------- State Variables ----------------------
-conversation_history = []  # Stores the conversation for context
-complaint_data = {}        # Stores current complaint info
-is_collecting_complaint = False  # True if in complaint registration flow
-current_complaint_step = None    # Current field being collected
-complaint_step_index = 0         # Index in complaint_fields
-just_registered_complaint = False  # True after complaint registration
-pending_complaint_start = False    # True if waiting for user to confirm registration start
-user_wants_more_detail = False     # Tracks if user wants more detail in general answers
+LM_STUDIO_MODELS_URL = LM_STUDIO_API_URL.rsplit('/', 1)[0] + "/models"  # Cheap endpoint used for warm-up
+# Shared keep-alive session so warm-up and chat calls reuse pooled connections
+LM_SESSION = requests.Session()
+LM_SESSION.headers.update({"Content-Type": "application/json"})
+if LM_STUDIO_API_KEY:
+    LM_SESSION.headers["Authorization"] = f"Bearer {LM_STUDIO_API_KEY}"
+LM_SESSION.mount("http://", requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=32))
+
+# Background worker used to overlap LM Studio warm-up with audio transcription
+background_executor = ThreadPoolExecutor(max_workers=2)
+
+# ---------------------- Whisper Model Setup ----------------------
+# Load the model once at startup and reuse it for every /process_audio request
+# (use 'base' for speed, 'small' or 'medium' for better accuracy; int8 keeps it fast and small)
+WHISPER_MODEL = WhisperModel(os.getenv("WHISPER_MODEL", "base"), device="auto", compute_type="int8",
+                             cpu_threads=os.cpu_count() or 0)
+
+# ---------------------- Complaint Storage ----------------------
+# One long-lived, unbuffered handle (each complaint is a single write); the lock keeps
+# concurrent registrations from interleaving
+COMPLAINTS_FILE = "complaints.json"
+COMPLAINT_FH = open(COMPLAINTS_FILE, "ab", buffering=0)
+COMPLAINT_LOCK = threading.Lock()
+
+# ---------------------- Session State ----------------------
+HISTORY_MAXLEN = 32  # Turns kept per session; older turns are evicted automatically
+PROMPT_HISTORY_TURNS = 5  # Most recent turns included in the LLM prompt
+
+@dataclass(slots=True)
+class ChatSession:
+    """Conversation and registration state for one browser session."""
+    conversation_history: deque = field(default_factory=lambda: deque(maxlen=HISTORY_MAXLEN))  # Recent conversation for context
+    complaint_data: dict = field(default_factory=dict)        # Stores current complaint info
+    is_collecting_complaint: bool = False     # True if in complaint registration flow
+    current_complaint_step: str | None = None # Current field being collected
+    complaint_step_index: int = 0             # Index in complaint_fields
+    fields_mask: int = 0                      # Bitmask of complaint_fields to collect
+    just_registered_complaint: bool = False   # True after complaint registration
+    pending_complaint_start: bool = False     # True if waiting for user to confirm registration start
+    user_wants_more_detail: bool = False      # Tracks if user wants more detail in general answers
+
+SESSION_COOKIE = "sid"
+MAX_SESSIONS = int(os.getenv("MAX_SESSIONS", "1000"))  # Least recently used sessions are evicted beyond this
+SESSIONS = OrderedDict()  # Maps session ID (from the "sid" cookie) to its ChatSession, oldest first
+# Sessions handed to requests that arrived without a cookie (API/curl/audio scripts usually never
+# send it back). They live in a separate, smaller pool so they can't evict browser sessions, and
+# are promoted into SESSIONS the first time the client returns the cookie.
+MAX_UNCONFIRMED_SESSIONS = int(os.getenv("MAX_UNCONFIRMED_SESSIONS", "100"))
+UNCONFIRMED_SESSIONS = OrderedDict()
+SESSIONS_LOCK = threading.Lock()
+
+def _store_session(store, limit, sid, chat_session):
+    """Add chat_session to store under sid, evicting the least recently used entries past limit.
+
+    Must be called with SESSIONS_LOCK held.
+    """
+    store[sid] = chat_session
+    while len(store) > limit:
+        store.popitem(last=False)
+    return chat_session
+
+def new_session(sid, replaces=None):
+    """Create and store a fresh ChatSession under sid, evicting the least recently used ones if full."""
+    with SESSIONS_LOCK:
+        SESSIONS.pop(replaces, None)
+        return _store_session(SESSIONS, MAX_SESSIONS, sid, ChatSession())
+
+def get_session():
+    """Return the ChatSession for the current request, creating one (and its cookie) if needed."""
+    sid = request.cookies.get(SESSION_COOKIE)
+    with SESSIONS_LOCK:
+        if not sid:
+            sid = uuid.uuid4().hex
+            g.new_sid = sid
+            return _store_session(UNCONFIRMED_SESSIONS, MAX_UNCONFIRMED_SESSIONS, sid, ChatSession())
+        chat_session = SESSIONS.get(sid)
+        if chat_session is not None:
+            SESSIONS.move_to_end(sid)
+            return chat_session
+        # Client sent the cookie back (or the server restarted): keep the session in the main pool
+        chat_session = UNCONFIRMED_SESSIONS.pop(sid, None) or ChatSession()
+        return _store_session(SESSIONS, MAX_SESSIONS, sid, chat_session)
 
 # ---------------------- Complaint Form Fields ----------------------
-complaint_fields = [
+complaint_fields = (
     "name", "mobile_number", "age", "pan_or_aadhar", "address", 
     "description", "bank_name", "account_number", "transaction_id", 
     "date_time", "recipient_name"
-]
+)
+bank_fields = ("bank_name", "account_number", "transaction_id", "date_time", "recipient_name")
+# Fields still to be collected are tracked per session as a bitmask over complaint_fields
+FIELD_IDX = {f: i for i, f in enumerate(complaint_fields)}
+
+def fields_mask(fields):
+    """Build a bitmask with the bit for each of the given fields set."""
+    mask = 0
+    for f in fields:
+        mask |= 1 << FIELD_IDX[f]
+    return mask
+
+BASE_FIELDS_MASK = fields_mask(complaint_fields)
+BANK_FIELDS_MASK = fields_mask(bank_fields)
+
+def next_field_index(mask, start):
+    """Return the index of the first needed field at or after start, or None if none are left."""
+    remaining = mask >> start
+    if not remaining:
+        return None
+    return start + (remaining & -remaining).bit_length() - 1
 # Extra details field and prompt for complaint registration
 extra_details_field = "extra_details"
 extra_details_prompt = "Is there any other detail you'd like to provide about the fraud (e.g., suspicious link, email, or other information)? If not, type 'no'."
@@ -64,22 +190,65 @@ complaint_intent_patterns = [
 fraud_info_patterns = [
     r"what is fraud", r"types of fraud", r"phishing", r"scam", r"fraud information", r"explain fraud", r"how to avoid fraud", r"what is a phishing scam", r"fraudulent", r"identity theft"
 ]
-cancel_patterns = [r"exit", r"cancel", r"stop", r"quit", r"no i don't want", r"no i dont want", r"don't want to register", r"dont want to register"]
+# Cancel intent is matched on whole words (so names like "Christopher" don't trigger "stop")
+cancel_words = frozenset({"exit", "cancel", "stop", "quit"})
+cancel_phrases = ("no i don't want", "no i dont want", "don't want to register", "dont want to register")
+# Post-registration follow-up phrases (literal substrings)
+thank_patterns = ["thank you", "thanks", "thankyou", "thx"]
+nextstep_patterns = [
+    "money back", "next step", "what should i do", "what to do", "how to recover",
+    "how do i get my money", "how to get my money", "how can i get my money back",
+    "what should i do to get my money back", "how to get my money back", "recover my money",
+    "get my money back", "how can i recover my money", "how do i recover my money",
+    "help me get my money back", "help to get my money back", "help recover my money",
+    "help me recover my money", "can you help me get my money back", "can you help recover my money",
+    "can you help me recover my money", "can you help me with my money back", "can you help with my money back"
+]
+
+def _compile_alternation(patterns):
+    """Fuse a list of patterns into one compiled regex so a single search covers them all."""
+    return re.compile("|".join(f"(?:{p})" for p in patterns))
+
+# Compile intent patterns once at import, one fused regex per intent class
+# (patterns are lowercase and are matched against the pre-lowercased user input)
+_FRAUD_RE = _compile_alternation(fraud_patterns)
+_COMPLAINT_RE = _compile_alternation(complaint_intent_patterns)
+_FRAUD_INFO_RE = _compile_alternation(fraud_info_patterns)
+_THANK_RE = _compile_alternation(re.escape(p) for p in thank_patterns)
+_NEXTSTEP_RE = _compile_alternation(re.escape(p) for p in nextstep_patterns)
+# Keywords in the fraud description that mean bank/transaction details are needed
+_BANK_TRIGGER_RE = re.compile(r"link|clicked|debited|transferred", re.IGNORECASE)
+# Splits input into bare words, dropping quotes and other punctuation ("'stop'" -> "stop")
+_WORD_RE = re.compile(r"[a-z]+")
+
+# ---------------------- Validation Patterns ----------------------
+# Used with fullmatch, so no ^/$ anchors are needed
+_NAME_RE = re.compile(r"[A-Za-z .'-]{2,50}")
+_NAME_PHRASE_RE = re.compile(r"(?:my name is|i am|this is)\s+([A-Za-z .'-]{2,50})", re.IGNORECASE)
+_MOBILE_RE = re.compile(r"[6-9][0-9]{9}")
+_PAN_RE = re.compile(r"[A-Z]{5}[0-9]{4}[A-Z]")
+_AADHAR_RE = re.compile(r"[0-9]{12}")
+_ACC_RE = re.compile(r"[0-9]{9,18}")
+_TXN_RE = re.compile(r"[A-Za-z0-9\-]{5,30}")
+known_banks = ["sbi", "hdfc", "icici", "axis", "kotak", "bob", "pnb", "canara", "union", "idbi", "yes bank", "indusind", "uco", "bandhan", "federal", "rbl", "bank of india", "bank of baroda"]
+_BANK_RE = re.compile("|".join(re.escape(b) for b in known_banks), re.IGNORECASE)
+# yyyy-mm-dd is tried first so a 4-digit year isn't first tried as a day
+_DATE_RE = re.compile(r"(?:\d{4}-\d{1,2}-\d{1,2}|\d{1,2}[/-]\d{1,2}[/-]\d{2,4})")
 
 # ---------------------- Validation Functions ----------------------
 def validate_name(name):
     """Accept only names, not sentences. Extract if user types 'my name is ...'."""
-    match = re.match(r"^[A-Za-z .'-]{2,50}$", name.strip())
+    match = _NAME_RE.fullmatch(name.strip())
     if match:
         return name.strip()
-    found = re.findall(r"(?:my name is|i am|this is)\s+([A-Za-z .'-]{2,50})", name.lower())
+    found = _NAME_PHRASE_RE.findall(name)
     if found:
         return found[0].title()
     return None
 
 def validate_mobile(mobile):
     """Validate Indian mobile number (10 digits, starts with 6-9)."""
-    match = re.match(r"^[6-9][0-9]{9}$", mobile.strip())
+    match = _MOBILE_RE.fullmatch(mobile.strip())
     return match is not None
 
 def validate_age(age):
@@ -93,8 +262,8 @@ def validate_age(age):
 def validate_pan_or_aadhar(value):
     """Validate PAN (ABCDE1234F) or 12-digit Aadhar."""
     value = value.strip()
-    pan = re.match(r"^[A-Z]{5}[0-9]{4}[A-Z]$", value.upper())
-    aadhar = re.match(r"^[0-9]{12}$", value)
+    pan = _PAN_RE.fullmatch(value.upper())
+    aadhar = _AADHAR_RE.fullmatch(value)
     return pan is not None or aadhar is not None
 
 def validate_address(address):
@@ -107,22 +276,21 @@ def validate_description(desc):
 
 def validate_bank_name(bank):
     """Validate bank name (common Indian banks or non-empty)."""
-    banks = ["sbi", "hdfc", "icici", "axis", "kotak", "bob", "pnb", "canara", "union", "idbi", "yes bank", "indusind", "uco", "bandhan", "federal", "rbl", "bank of india", "bank of baroda"]
-    return any(b in bank.lower() for b in banks) or len(bank.strip()) > 2
+    return _BANK_RE.search(bank) is not None or len(bank.strip()) > 2
 
 def validate_account_number(acc):
     """Validate account number (9-18 digits)."""
-    return re.match(r"^[0-9]{9,18}$", acc.strip()) is not None
+    return _ACC_RE.fullmatch(acc.strip()) is not None
 
 def validate_transaction_id(txn):
     """Accept blank, 'don't know', or valid alphanumeric."""
     if txn.strip() == '' or txn.strip().lower() in ["don't know", "dont know"]:
         return True
-    return re.match(r"^[A-Za-z0-9\-]{5,30}$", txn.strip()) is not None
+    return _TXN_RE.fullmatch(txn.strip()) is not None
 
 def validate_date_time(dt):
     """Accept dd/mm/yyyy, dd-mm-yyyy, yyyy-mm-dd, etc."""
-    return re.match(r"^(\d{1,2}[/-]\d{1,2}[/-]\d{2,4}|\d{4}-\d{1,2}-\d{1,2})$", dt.strip()) is not None
+    return _DATE_RE.fullmatch(dt.strip()) is not None
 
 def validate_recipient_name(name):
     """Validate recipient name (same as validate_name)."""
@@ -144,36 +312,31 @@ complaint_field_validators = {
 }
 
 # ---------------------- Intent Detection Functions ----------------------
-def is_fraud_related(user_input):
+# These expect the user input already lowercased (done once per request)
+def is_fraud_related(user_input_lc):
     """Detect if input is fraud-related."""
-    return any(re.search(pattern, user_input.lower()) for pattern in fraud_patterns)
+    return _FRAUD_RE.search(user_input_lc) is not None
 
-def is_complaint_intent(user_input):
+def is_complaint_intent(user_input_lc):
     """Detect if user wants to register a complaint."""
-    return any(re.search(pattern, user_input.lower()) for pattern in complaint_intent_patterns)
+    return _COMPLAINT_RE.search(user_input_lc) is not None
 
-def is_fraud_info_intent(user_input):
+def is_fraud_info_intent(user_input_lc):
     """Detect if user is asking about fraud info."""
-    return any(re.search(pattern, user_input.lower()) for pattern in fraud_info_patterns)
+    return _FRAUD_INFO_RE.search(user_input_lc) is not None
 
-def is_cancel_intent(user_input):
+def is_cancel_intent(user_input_lc):
     """Detect if user wants to cancel/exit registration."""
-    return any(re.search(pattern, user_input.lower()) for pattern in cancel_patterns)
+    words = set(_WORD_RE.findall(user_input_lc))
+    return bool(cancel_words & words) or any(p in user_input_lc for p in cancel_phrases)
 
 def analyze_description(description):
-    """Analyze description to determine if extra fields are needed."""
-    additional_fields = []
-    if any(keyword in description.lower() for keyword in ["link", "clicked", "debited", "transferred"]):
-        additional_fields.extend(["bank_name", "account_number", "transaction_id", "date_time", "recipient_name"])
-    return additional_fields
+    """Analyze description to determine if extra fields are needed. Returns a fields bitmask."""
+    return BANK_FIELDS_MASK if _BANK_TRIGGER_RE.search(description) else 0
 
 # ---------------------- LM Studio API Helper ----------------------
 def generate_response(prompt):
     """Generate a response using Hermes LLaMA via LM Studio API."""
-    headers = {
-        "Authorization": f"Bearer {LM_STUDIO_API_KEY}" if LM_STUDIO_API_KEY else "",
-        "Content-Type": "application/json"
-    }
     payload = {
         "prompt": prompt,
         "max_tokens": 512,
@@ -181,133 +344,211 @@ def generate_response(prompt):
         "top_p": 0.9
     }
     try:
-        logger.debug(f"Sending request to LM Studio with prompt: {prompt}")
-        response = requests.post(LM_STUDIO_API_URL, headers=headers, json=payload, timeout=30)
+        logger.debug("Sending request to LM Studio with prompt: %s", prompt)
+        response = LM_SESSION.post(LM_STUDIO_API_URL, data=orjson.dumps(payload), timeout=30)
         response.raise_for_status()
-        result = response.json()["choices"][0]["text"].strip()
-        logger.debug(f"Received response from LM Studio: {result}")
+        result = orjson.loads(response.content)["choices"][0]["text"].strip()
+        logger.debug("Received response from LM Studio: %s", result)
         return result
     except requests.exceptions.RequestException as e:
         logger.error(f"LM Studio API error: {str(e)}")
         return f"Error communicating with LM Studio API: {str(e)}"
+    except (orjson.JSONDecodeError, KeyError, IndexError, TypeError, AttributeError) as e:
+        # Body that isn't JSON or has no choices[0].text (e.g. an {"error": ...} reply)
+        logger.error(f"Unexpected LM Studio API response: {str(e)}")
+        return f"Error communicating with LM Studio API: {str(e)}"
+
+class LMStudioStreamError(Exception):
+    """Raised by stream_response when LM Studio fails mid-stream; the message is shown to the user."""
+
+def stream_response(prompt):
+    """Stream a response from Hermes LLaMA via LM Studio API, yielding text chunks as they arrive.
+
+    Raises LMStudioStreamError if the request fails or the stream can't be read.
+    """
+    payload = {
+        "prompt": prompt,
+        "max_tokens": 512,
+        "temperature": 0.7,
+        "top_p": 0.9,
+        "stream": True
+    }
+    try:
+        logger.debug("Streaming request to LM Studio with prompt: %s", prompt)
+        with LM_SESSION.post(LM_STUDIO_API_URL, data=orjson.dumps(payload), stream=True, timeout=30) as response:
+            response.raise_for_status()
+            # LM Studio sends server-sent events: "data: {...}" lines, ending with "data: [DONE]"
+            for line in response.iter_lines():
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[len(b"data:"):].strip()
+                if data == b"[DONE]":
+                    break
+                try:
+                    text = orjson.loads(data)["choices"][0].get("text", "")
+                except (orjson.JSONDecodeError, KeyError, IndexError, TypeError, AttributeError) as e:
+                    # Malformed event or an {"error": ...} event without choices; end the reply cleanly
+                    logger.error(f"Unexpected LM Studio stream event {data[:200]!r}: {str(e)}")
+                    raise LMStudioStreamError(f"Error reading LM Studio API response: {str(e)}") from e
+                if text:
+                    yield text
+    except requests.exceptions.RequestException as e:
+        logger.error(f"LM Studio API error: {str(e)}")
+        raise LMStudioStreamError(f"Error communicating with LM Studio API: {str(e)}") from e
+
+def warm_up_lm_studio():
+    """Open a connection to LM Studio ahead of time so the next completion skips connection setup."""
+    try:
+        LM_SESSION.get(LM_STUDIO_MODELS_URL, timeout=5).close()
+        logger.debug("LM Studio connection warmed up")
+    except requests.exceptions.RequestException as e:
+        logger.debug("LM Studio warm-up failed: %s", e)
 
 # ---------------------- Complaint Summary Generator ----------------------
 def generate_complaint_summary(complaint_data):
     """Generate a summary of the complaint for user confirmation."""
-    summary = (
-        f"Complaint Summary:\n"
-        f"Name: {complaint_data.get('name', 'N/A')}\n"
-        f"Mobile Number: {complaint_data.get('mobile_number', 'N/A')}\n"
-        f"Age: {complaint_data.get('age', 'N/A')}\n"
-        f"PAN/Aadhar Number: {complaint_data.get('pan_or_aadhar', 'N/A')}\n"
-        f"Address: {complaint_data.get('address', 'N/A')}\n"
-        f"Description of Fraud: {complaint_data.get('description', 'N/A')}\n"
-    )
-    if "bank_name" in complaint_data:
-        summary += (
-            f"Bank Name: {complaint_data.get('bank_name', 'N/A')}\n"
-            f"Account Number: {complaint_data.get('account_number', 'N/A')}\n"
-            f"Transaction ID: {complaint_data.get('transaction_id', 'N/A')}\n"
-            f"Date and Time: {complaint_data.get('date_time', 'N/A')}\n"
-            f"Recipient Name: {complaint_data.get('recipient_name', 'N/A')}\n"
-        )
-    if 'extra_details' in complaint_data:
-        summary += f"Extra Details: {complaint_data.get('extra_details', 'N/A')}\n"
-    return summary
+    cd = complaint_data
+    lines = [
+        "Complaint Summary:",
+        f"Name: {cd.get('name', 'N/A')}",
+        f"Mobile Number: {cd.get('mobile_number', 'N/A')}",
+        f"Age: {cd.get('age', 'N/A')}",
+        f"PAN/Aadhar Number: {cd.get('pan_or_aadhar', 'N/A')}",
+        f"Address: {cd.get('address', 'N/A')}",
+        f"Description of Fraud: {cd.get('description', 'N/A')}",
+    ]
+    if "bank_name" in cd:
+        lines.extend([
+            f"Bank Name: {cd['bank_name']}",
+            f"Account Number: {cd.get('account_number', 'N/A')}",
+            f"Transaction ID: {cd.get('transaction_id', 'N/A')}",
+            f"Date and Time: {cd.get('date_time', 'N/A')}",
+            f"Recipient Name: {cd.get('recipient_name', 'N/A')}",
+        ])
+    if 'extra_details' in cd:
+        lines.append(f"Extra Details: {cd['extra_details']}")
+    lines.append("")  # Keep the trailing newline
+    return "\n".join(lines)
 
 # ---------------------- Flask Routes ----------------------
 @app.route('/')
 def index():
     """Serve the main chat UI."""
-    global conversation_history
     try:
         if not os.path.exists(os.path.join(app.template_folder, 'index.html')):
             logger.error("index.html not found in templates folder")
             return "Error: index.html not found in templates folder", 500
-        conversation_history = []  # Reset history on page load
+        # Start a fresh session on page load
+        sid = uuid.uuid4().hex
+        g.new_sid = sid
+        chat_session = new_session(sid, replaces=request.cookies.get(SESSION_COOKIE))
         initial_message = "Hey there! I'm Siri, your friendly Fraud Registration Assistant. Ready to help—what's on your mind?"
-        conversation_history.append({"role": "assistant", "content": initial_message})
+        chat_session.conversation_history.append({"role": "assistant", "content": initial_message})
         logger.debug("Serving index.html with initial message")
         return render_template('index.html', initial_message=initial_message)
     except Exception as e:
         logger.error(f"Error serving index.html: {str(e)}", exc_info=True)
         return f"Error serving index.html: {str(e)}", 500
 
-@app.route('/static/<path:filename>')
-def serve_static(filename):
-    """Serve static files (CSS, images, JS)."""
-    try:
-        if not os.path.exists(os.path.join(app.static_folder, filename)):
-            logger.error(f"Static file {filename} not found in static folder")
-            return f"Static file {filename} not found", 404
-        return send_from_directory(app.static_folder, filename)
-    except Exception as e:
-        logger.error(f"Error serving static file {filename}: {str(e)}", exc_info=True)
-        return f"Error serving static file: {str(e)}", 500
+# Static files (CSS, images, JS) are served by Flask's built-in /static/ route, which
+# supports conditional requests (304s). In production, serve /static/ from the front-end
+# web server (e.g. Nginx) instead so these requests never reach Python.
 
 # ---------------------- Main Chat/Process Logic ----------------------
-def handle_chat_request():
-    """Shared logic for /chat and /process endpoints. Handles all chat, registration, and validation flows."""
-    global is_collecting_complaint, current_complaint_step, complaint_step_index, complaint_data, user_wants_more_detail, just_registered_complaint, pending_complaint_start
+def _stream_llm_reply(prompt, chat_session):
+    """Yield {"token": ...} events for the LLM reply, then record it in the conversation history.
+
+    Errors are yielded as a separate {"error": ...} event (headers are already sent by then)
+    and are never stored in the history as something the assistant said.
+    """
+    chunks = []
+    error = None
     try:
-        logger.debug(f"Raw request data: {request.data.decode('utf-8', errors='ignore')}")
-        data = request.get_json(force=False)
-        if not data:
-            logger.error("No JSON payload received")
-            return jsonify({"response": "Error: No JSON payload received. Please send a valid JSON payload."}), 400
-        user_input = data.get('message', data.get('text', '')).strip()
-        if not user_input:
-            logger.error(f"Invalid JSON payload, missing 'message' or 'text': {data}")
-            return jsonify({"response": "Error: Invalid input. Please send a valid JSON payload with a 'message' or 'text' field."}), 400
-        logger.debug(f"Received user input: {user_input}")
+        for chunk in stream_response(prompt):
+            if not chunks:
+                chunk = chunk.lstrip()
+                if not chunk:
+                    continue
+            chunks.append(chunk)
+            yield {"token": chunk}
+    except LMStudioStreamError as e:
+        error = str(e)
+    except Exception as e:
+        logger.error(f"Error in _stream_llm_reply: {str(e)}", exc_info=True)
+        error = f"Server error: {str(e)}"
+    if error:
+        yield {"error": error}
+    response = "".join(chunks).strip()
+    if response:
+        chat_session.conversation_history.append({"role": "assistant", "content": response})
+    logger.debug("Sending response: %s", response)
+    logger.info(f"Outgoing response: {str(response)[:200]}")
+
+def _sse_events(events):
+    """Serialize event dicts as server-sent events, finishing with a done event."""
+    for event in events:
+        yield f"data: {orjson.dumps(event).decode()}\n\n"
+    yield f"data: {orjson.dumps({'done': True}).decode()}\n\n"
+
+def _process_user_message(user_input, chat_session, stream=False):
+    """Run one user message through the chat, registration, and validation flows.
+
+    Returns a (response_dict, status_code) tuple so both the JSON endpoints and
+    the audio endpoint can reuse it without building a Flask request. With
+    stream=True, LLM answers come back as a generator of token/error events instead
+    of a dict; scripted replies (registration prompts etc.) are always dicts.
+    """
+    try:
+        logger.debug("Received user input: %s", user_input)
+        user_input_lc = user_input.lower()  # Lowercased once and shared by all intent checks
 
-        conversation_history.append({"role": "user", "content": user_input})
+        chat_session.conversation_history.append({"role": "user", "content": user_input})
 
         # 1. Allow user to cancel registration at any time
-        if is_collecting_complaint and is_cancel_intent(user_input):
-            is_collecting_complaint = False
-            complaint_data = {}
-            complaint_step_index = 0
-            current_complaint_step = None
-            pending_complaint_start = False
+        if chat_session.is_collecting_complaint and is_cancel_intent(user_input_lc):
+            chat_session.is_collecting_complaint = False
+            chat_session.complaint_data = {}
+            chat_session.complaint_step_index = 0
+            chat_session.fields_mask = 0
+            chat_session.current_complaint_step = None
+            chat_session.pending_complaint_start = False
             logger.info("Complaint registration cancelled by user.")
             response = "Complaint registration has been cancelled. If you need help with anything else, just let me know!"
             logger.info(f"Outgoing response: {str(response)[:200]}")
-            return jsonify({"response": response})
+            return {"response": response}, 200
 
         # 1.5. Handle pre-registration confirmation
-        if pending_complaint_start:
-            if user_input.strip().lower() in ["yes", "y"]:
-                pending_complaint_start = False
-                is_collecting_complaint = True
-                complaint_step_index = 0
-                complaint_data = {}
-                complaint_data['complaint_fields_to_collect'] = complaint_fields.copy()
-                current_complaint_step = complaint_fields[complaint_step_index]
-                prompt = complaint_field_validators.get(current_complaint_step, (None, None))[1] or f"Please provide your {current_complaint_step.replace('_', ' ')}:"
-                conversation_history.append({"role": "assistant", "content": prompt})
-                logger.debug(f"Starting registration after confirmation. Sending prompt: {prompt}")
+        if chat_session.pending_complaint_start:
+            if user_input_lc in ["yes", "y"]:
+                chat_session.pending_complaint_start = False
+                chat_session.is_collecting_complaint = True
+                chat_session.complaint_step_index = 0
+                chat_session.complaint_data = {}
+                chat_session.fields_mask = BASE_FIELDS_MASK
+                chat_session.current_complaint_step = complaint_fields[chat_session.complaint_step_index]
+                prompt = complaint_field_validators.get(chat_session.current_complaint_step, (None, None))[1] or f"Please provide your {chat_session.current_complaint_step.replace('_', ' ')}:"
+                chat_session.conversation_history.append({"role": "assistant", "content": prompt})
+                logger.debug("Starting registration after confirmation. Sending prompt: %s", prompt)
                 logger.info(f"Outgoing response: {str(prompt)[:200]}")
-                return jsonify({"response": prompt})
-            elif user_input.strip().lower() in ["no", "n"]:
-                pending_complaint_start = False
+                return {"response": prompt}, 200
+            elif user_input_lc in ["no", "n"]:
+                chat_session.pending_complaint_start = False
                 response = "Complaint registration has been cancelled. If you need help with anything else, just let me know!"
                 logger.info(f"Outgoing response: {str(response)[:200]}")
-                return jsonify({"response": response})
+                return {"response": response}, 200
             else:
                 prompt = ("Please reply 'yes' to proceed with registering your complaint, or 'no' to cancel.")
-                conversation_history.append({"role": "assistant", "content": prompt})
+                chat_session.conversation_history.append({"role": "assistant", "content": prompt})
                 logger.info(f"Outgoing response: {str(prompt)[:200]}")
-                return jsonify({"response": prompt})
+                return {"response": prompt}, 200
 
         # 2. If in registration flow, handle registration and return (never call LLM)
-        if is_collecting_complaint:
-            if 'complaint_fields_to_collect' not in complaint_data:
-                complaint_data['complaint_fields_to_collect'] = complaint_fields.copy()
-            fields_to_collect = complaint_data['complaint_fields_to_collect']
+        if chat_session.is_collecting_complaint:
+            if not chat_session.fields_mask:
+                chat_session.fields_mask = BASE_FIELDS_MASK
             # Save the user's answer for the current step
-            if current_complaint_step:
-                validator, error_prompt = complaint_field_validators.get(current_complaint_step, (None, None))
+            if chat_session.current_complaint_step:
+                validator, error_prompt = complaint_field_validators.get(chat_session.current_complaint_step, (None, None))
                 valid = True
                 value = user_input
                 if validator:
@@ -317,64 +558,63 @@ def handle_chat_request():
                     elif isinstance(result, str):
                         value = result
                 if not valid:
-                    logger.info(f"Invalid input for {current_complaint_step}: {user_input}")
-                    conversation_history.append({"role": "assistant", "content": error_prompt})
+                    logger.info(f"Invalid input for {chat_session.current_complaint_step}: {user_input}")
+                    chat_session.conversation_history.append({"role": "assistant", "content": error_prompt})
                     logger.info(f"Outgoing response: {str(error_prompt)[:200]}")
-                    return jsonify({"response": error_prompt})
-                complaint_data[current_complaint_step] = value
+                    return {"response": error_prompt}, 200
+                chat_session.complaint_data[chat_session.current_complaint_step] = value
             # If we just got the description, check if we need to add extra fields
-            if current_complaint_step == 'description':
-                additional_fields = analyze_description(user_input)
-                for field in additional_fields:
-                    if field not in fields_to_collect:
-                        fields_to_collect.append(field)
-            # Move to the next field
-            complaint_step_index += 1
-            # If all required fields are collected, prompt for extra details
-            if complaint_step_index == len(fields_to_collect):
-                current_complaint_step = extra_details_field
-                prompt = extra_details_prompt
-                conversation_history.append({"role": "assistant", "content": prompt})
-                logger.debug(f"Sending prompt: {prompt}")
-                logger.info(f"Outgoing response: {str(prompt)[:200]}")
-                return jsonify({"response": prompt})
+            if chat_session.current_complaint_step == 'description':
+                chat_session.fields_mask |= analyze_description(user_input)
+            # Find the next field to collect (None once all required fields are collected)
+            next_index = next_field_index(chat_session.fields_mask, chat_session.complaint_step_index + 1)
             # Handle extra details step
-            elif current_complaint_step == extra_details_field:
-                if user_input.strip().lower() in ["no", "nothing else", "none"]:
-                    complaint_data[extra_details_field] = "No extra details provided."
+            if chat_session.current_complaint_step == extra_details_field:
+                if user_input_lc in ["no", "nothing else", "none"]:
+                    chat_session.complaint_data[extra_details_field] = "No extra details provided."
                 else:
-                    complaint_data[extra_details_field] = user_input.strip()
-                is_collecting_complaint = False
-                summary = generate_complaint_summary(complaint_data)
-                conversation_history.append({"role": "assistant", "content": summary})
+                    chat_session.complaint_data[extra_details_field] = user_input.strip()
+                chat_session.is_collecting_complaint = False
+                summary = generate_complaint_summary(chat_session.complaint_data)
+                chat_session.conversation_history.append({"role": "assistant", "content": summary})
                 try:
-                    with open("complaints.json", "a") as f:
-                        data_to_save = {k: v for k, v in complaint_data.items() if k != 'complaint_fields_to_collect'}
-                        json.dump(data_to_save, f)
-                        f.write("\n")
-                    logger.debug("Complaint saved to complaints.json")
-                    logger.info(f"Complaint registered: {json.dumps(data_to_save)}")
+                    data_to_save = chat_session.complaint_data
+                    line = orjson.dumps(data_to_save) + b"\n"
+                    with COMPLAINT_LOCK:
+                        COMPLAINT_FH.write(line)
+                    logger.debug("Complaint saved to %s", COMPLAINTS_FILE)
+                    logger.info(f"Complaint registered: {line.rstrip().decode()}")
                 except Exception as e:
                     logger.error(f"Error saving complaint: {str(e)}", exc_info=True)
-                    return jsonify({"response": f"Error saving complaint: {str(e)}"}), 500
-                complaint_data = {}
-                complaint_step_index = 0
-                current_complaint_step = None
+                    return {"response": f"Error saving complaint: {str(e)}"}, 500
+                chat_session.complaint_data = {}
+                chat_session.complaint_step_index = 0
+                chat_session.fields_mask = 0
+                chat_session.current_complaint_step = None
                 response = summary + "\nYour complaint has been registered. How else can I assist you?"
                 logger.info(f"Outgoing response: {str(response)[:200]}")
-                just_registered_complaint = True
-                return jsonify({"response": response})
-            elif complaint_step_index < len(fields_to_collect):
-                current_complaint_step = fields_to_collect[complaint_step_index]
-                prompt = complaint_field_validators.get(current_complaint_step, (None, None))[1] or f"Please provide your {current_complaint_step.replace('_', ' ')}:"
-                conversation_history.append({"role": "assistant", "content": prompt})
-                logger.debug(f"Sending prompt: {prompt}")
+                chat_session.just_registered_complaint = True
+                return {"response": response}, 200
+            # If all required fields are collected, prompt for extra details
+            elif next_index is None:
+                chat_session.current_complaint_step = extra_details_field
+                prompt = extra_details_prompt
+                chat_session.conversation_history.append({"role": "assistant", "content": prompt})
+                logger.debug("Sending prompt: %s", prompt)
+                logger.info(f"Outgoing response: {str(prompt)[:200]}")
+                return {"response": prompt}, 200
+            else:
+                chat_session.complaint_step_index = next_index
+                chat_session.current_complaint_step = complaint_fields[next_index]
+                prompt = complaint_field_validators.get(chat_session.current_complaint_step, (None, None))[1] or f"Please provide your {chat_session.current_complaint_step.replace('_', ' ')}:"
+                chat_session.conversation_history.append({"role": "assistant", "content": prompt})
+                logger.debug("Sending prompt: %s", prompt)
                 logger.info(f"Outgoing response: {str(prompt)[:200]}")
-                return jsonify({"response": prompt})
+                return {"response": prompt}, 200
 
         # 3. If complaint intent detected, show pre-registration message and set flag
-        if is_complaint_intent(user_input):
-            pending_complaint_start = True
+        if is_complaint_intent(user_input_lc):
+            chat_session.pending_complaint_start = True
             instruction_msg = (
                 "Before we begin registering your fraud complaint, please note:\n"
                 "- Only provide the specific information requested at each step.\n"
@@ -382,40 +622,29 @@ def handle_chat_request():
                 "- If at any point you wish to stop the registration process, simply type 'exit', 'cancel', or 'stop'.\n"
                 "Would you like to proceed with registering your complaint? (yes/no)"
             )
-            conversation_history.append({"role": "assistant", "content": instruction_msg})
+            chat_session.conversation_history.append({"role": "assistant", "content": instruction_msg})
             logger.info(f"Outgoing response: {str(instruction_msg)[:200]}")
-            return jsonify({"response": instruction_msg})
+            return {"response": instruction_msg}, 200
 
         # 4. If just registered, handle post-registration and return
-        if just_registered_complaint:
-            thank_patterns = ["thank you", "thanks", "thankyou", "thx"]
-            nextstep_patterns = [
-                "money back", "next step", "what should i do", "what to do", "how to recover",
-                "how do i get my money", "how to get my money", "how can i get my money back",
-                "what should i do to get my money back", "how to get my money back", "recover my money",
-                "get my money back", "how can i recover my money", "how do i recover my money",
-                "help me get my money back", "help to get my money back", "help recover my money",
-                "help me recover my money", "can you help me get my money back", "can you help recover my money",
-                "can you help me recover my money", "can you help me with my money back", "can you help with my money back"
-            ]
-            user_lower = user_input.lower()
-            if any(tp in user_lower for tp in thank_patterns):
-                just_registered_complaint = False
+        if chat_session.just_registered_complaint:
+            if _THANK_RE.search(user_input_lc):
+                chat_session.just_registered_complaint = False
                 response = "You're welcome! If you need any further help or guidance, please let me know."
-                return jsonify({"response": response})
-            elif any(np in user_lower for np in nextstep_patterns):
-                just_registered_complaint = False
+                return {"response": response}, 200
+            elif _NEXTSTEP_RE.search(user_input_lc):
+                chat_session.just_registered_complaint = False
                 response = ("Please promptly report the incident to your bank and keep all evidence safe. "
                             "For further assistance, you may also visit your local police station. "
                             "If you need more guidance, let me know.")
-                return jsonify({"response": response})
+                return {"response": response}, 200
 
         # 5. Only call the LLM for general questions if none of the above apply
         # Short/long answer logic for general questions
-        if user_input.lower() in ["yes", "more", "tell me more", "details", "explain more"]:
-            user_wants_more_detail = True
-        elif user_input.lower() in ["short", "in short", "brief", "summary"]:
-            user_wants_more_detail = False
+        if user_input_lc in ["yes", "more", "tell me more", "details", "explain more"]:
+            chat_session.user_wants_more_detail = True
+        elif user_input_lc in ["short", "in short", "brief", "summary"]:
+            chat_session.user_wants_more_detail = False
         system_prompt = (
             "You are Siri, a helpful assistant who specializes in fraud registration and fraud-related topics, but you can also answer general questions if asked. "
             "For general questions, first provide a concise summary. Then ask: 'Would you like to know more about this topic?' If the user says yes, provide a detailed answer. If the user says 'short', always provide a brief answer. "
@@ -423,27 +652,65 @@ def handle_chat_request():
             "Do not use emoticons, asterisks, or describe actions like *smiles* or *waves* in your responses. Keep your answers professional and to the point."
         )
         prompt = system_prompt
-        for entry in conversation_history[-5:]:
+        history = chat_session.conversation_history
+        for entry in islice(history, max(len(history) - PROMPT_HISTORY_TURNS, 0), None):
             role = "User" if entry["role"] == "user" else "Assistant"
             prompt += f"{role}: {entry['content']}\n"
         prompt += "Assistant: "
-        if user_wants_more_detail:
+        if chat_session.user_wants_more_detail:
             prompt += "(Please provide a detailed answer.)\n"
+        if stream:
+            return _stream_llm_reply(prompt, chat_session), 200
         response = generate_response(prompt)
-        conversation_history.append({"role": "assistant", "content": response})
-        logger.debug(f"Sending response: {response}")
+        chat_session.conversation_history.append({"role": "assistant", "content": response})
+        logger.debug("Sending response: %s", response)
         logger.info(f"Outgoing response: {str(response)[:200]}")
-        return jsonify({"response": response})
+        return {"response": response}, 200
 
+    except Exception as e:
+        logger.error(f"Error in _process_user_message: {str(e)}", exc_info=True)
+        return {"response": f"Server error: {str(e)}"}, 500
+
+INVALID_INPUT_MESSAGE = "Error: Invalid input. Please send a valid JSON payload with a 'message' or 'text' field."
+
+def handle_chat_request(stream=False):
+    """Shared logic for /chat and /process endpoints. Extracts the message from the JSON payload.
+
+    With stream=True, LLM answers are sent as a text/event-stream response.
+    """
+    try:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Raw request data: %s", request.data.decode('utf-8', errors='ignore'))
+        data = request.get_json(force=False)
+        if not data:
+            logger.error("No JSON payload received")
+            return jsonify({"response": "Error: No JSON payload received. Please send a valid JSON payload."}), 400
+        user_input = data.get('message', data.get('text', '')).strip()
+        if not user_input:
+            logger.error(f"Invalid JSON payload, missing 'message' or 'text': {data}")
+            return jsonify({"response": INVALID_INPUT_MESSAGE}), 400
+        response_data, status = _process_user_message(user_input, get_session(), stream=stream)
+        if isinstance(response_data, dict):
+            return jsonify(response_data), status
+        return Response(stream_with_context(_sse_events(response_data)), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})  # Stop Nginx buffering the stream
     except Exception as e:
         logger.error(f"Error in handle_chat_request: {str(e)}", exc_info=True)
         return jsonify({"response": f"Server error: {str(e)}"}), 500
 
+@app.after_request
+def set_session_cookie(response):
+    """Send the session cookie to clients that were just given a new session."""
+    sid = g.pop('new_sid', None)
+    if sid:
+        response.set_cookie(SESSION_COOKIE, sid, httponly=True, samesite='Lax')
+    return response
+
 # ---------------------- Chat Endpoints ----------------------
 @app.route('/chat', methods=['POST'])
 def chat():
-    """Chat endpoint for AJAX/web requests."""
-    return handle_chat_request()
+    """Chat endpoint for AJAX/web requests (streams LLM answers as server-sent events)."""
+    return handle_chat_request(stream=True)
 
 @app.route('/process', methods=['POST'])
 def process():
@@ -455,25 +722,26 @@ def process():
 def process_audio():
     """Transcribe audio using Whisper and process as chat message."""
     try:
-        logger.debug(f"Received audio request: {request.files}")
+        logger.debug("Received audio request: %s", request.files)
         if 'audio' not in request.files:
             logger.error("No audio file in request")
             return jsonify({"response": "Error: No audio file provided.", "transcription": ""}), 400
         audio_file = request.files['audio']
-        # Save audio to a temporary file
-        with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp:
-            audio_file.save(tmp.name)
-            tmp_path = tmp.name
-        # Load Whisper model (use 'base' for speed, 'small' or 'medium' for better accuracy)
-        model = whisper.load_model('base')
-        result = model.transcribe(tmp_path)
-        transcription = result['text'].strip()
+        # Warm up the LM Studio connection while Whisper is busy transcribing
+        background_executor.submit(warm_up_lm_studio)
+        # Decode the upload in memory to 16 kHz mono float32 (no temp file round-trip)
+        audio = decode_audio(io.BytesIO(audio_file.read()), sampling_rate=16000)
+        # vad_filter drops silent stretches before they reach the encoder
+        segments, _ = WHISPER_MODEL.transcribe(audio, beam_size=1, vad_filter=True)
+        transcription = "".join(s.text for s in segments).strip()  # Segment texts carry their own leading space
         logger.info(f"Audio transcription: {transcription}")
+        # Silent or unintelligible audio transcribes to nothing; reject it like an empty chat
+        # message so it can't be recorded as an answer or reach the LLM
+        if not transcription:
+            logger.error("Empty audio transcription")
+            return jsonify({"transcription": "", "response": INVALID_INPUT_MESSAGE})
         # Process the transcription as a normal chat message
-        data = {'message': transcription}
-        with app.test_request_context('/chat', method='POST', json=data):
-            chat_response = chat()
-            chat_json = chat_response.get_json()
+        chat_json, _ = _process_user_message(transcription, get_session())
         return jsonify({
             "transcription": transcription,
             "response": chat_json.get('response', '')
@@ -485,6 +753,10 @@ def process_audio():
 # ---------------------- App Startup/Shutdown ----------------------
 def on_shutdown():
     logger.info('--- Application Shutdown ---')
+    background_executor.shutdown(wait=False)
+    with COMPLAINT_LOCK:
+        COMPLAINT_FH.close()
+    log_listener.stop()  # Flushes any queued records
 
 atexit.register(on_shutdown)
 
@@ -514,7 +786,8 @@ if __name__ == '__main__':
             sys.exit(1)
         logger.info(f"Starting Flask application on port {port}")
         print(f"Flask app running on http://localhost:{port}/")
-        app.run(debug=True, port=port)
+        # Development server only; for production run under gunicorn (see README)
+        app.run(port=port)
     except Exception as e:
         logger.error(f"Failed to start Flask app: {str(e)}", exc_info=True)
         print(f"Error starting Flask app: {str(e)}")
@@ -77,6 +77,37 @@ function appendMessage(message, sender = 'bot') {
     msgDiv.appendChild(box);
     chatBox.appendChild(msgDiv);
     chatBox.scrollTop = chatBox.scrollHeight;
+    return box;
+}
+
+// Read a text/event-stream reply, rendering tokens into the message box as they arrive.
+// An error event is shown on its own line after any partial reply.
+async function readStream(response, box) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let text = '';
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const event of events) {
+            if (!event.startsWith('data:')) continue;
+            const data = JSON.parse(event.slice(5));
+            if (data.token) {
+                text += data.token;
+                box.textContent = text;
+                chatBox.scrollTop = chatBox.scrollHeight;
+            } else if (data.error) {
+                box.textContent = text ? text + '\n' + data.error : data.error;
+                chatBox.scrollTop = chatBox.scrollHeight;
+                return text || data.error;
+            }
+        }
+    }
+    return text;
 }
 
 // Initial message
@@ -92,14 +123,21 @@ chatForm.onsubmit = async (e) => {
     appendMessage(text, 'user');
     userInput.value = '';
     try {
-        const response = await fetch('/process', {
+        const response = await fetch('/chat', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({ message: text })
         });
-        const data = await response.json();
-        appendMessage(data.response, 'bot');
-        speak(data.response);
+        // LLM answers are streamed; scripted replies (registration prompts etc.) come back as JSON
+        if ((response.headers.get('Content-Type') || '').startsWith('text/event-stream')) {
+            const box = appendMessage('', 'bot');
+            const reply = await readStream(response, box);
+            speak(reply);
+        } else {
+            const data = await response.json();
+            appendMessage(data.response, 'bot');
+            speak(data.response);
+        }
     } catch (err) {
         appendMessage('Sorry, something went wrong. Please try again.', 'bot');
     }